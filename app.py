@@ -1,12 +1,10 @@
 import streamlit as st
-import boto3
-import os
+import re
+import time
 import uuid
-from botocore.exceptions import ClientError
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from collections import deque
+from itertools import islice
+from bedrock_core import load_config, stream_agent
 
 # Page configuration
 st.set_page_config(
@@ -15,11 +13,60 @@ st.set_page_config(
     layout="wide"  # Use wide layout for better citation sidebar
 )
 
+# Load environment variables from .env file, once per process
+@st.cache_resource(show_spinner=False)
+def _load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+    return True
+
+_load_env()
+
+# AWS Configuration - Get from environment variables or Streamlit secrets
+config = load_config()
+
+# Chat history is kept as parallel bounded arrays (role, content, citations, response flags)
+MAX_HISTORY_MESSAGES = 200
+
+def reset_chat_history():
+    """Start a new, empty chat history"""
+    st.session_state.roles = deque(maxlen=MAX_HISTORY_MESSAGES)
+    st.session_state.contents = deque(maxlen=MAX_HISTORY_MESSAGES)
+    st.session_state.cites = deque(maxlen=MAX_HISTORY_MESSAGES)
+    st.session_state.flags = deque(maxlen=MAX_HISTORY_MESSAGES)
+    # Index of the most recent message with citations, shown in the sidebar
+    st.session_state.last_cited_idx = None
+
+def append_message(role, content, citations=None, flags=None):
+    """
+    Append a message to the chat history; citations must already be flattened and
+    flags come from response_flags for assistant messages
+    """
+    if len(st.session_state.roles) == MAX_HISTORY_MESSAGES:
+        # The oldest message is about to drop off; shift the cited index along with it
+        last_cited_idx = st.session_state.last_cited_idx
+        if last_cited_idx is not None:
+            st.session_state.last_cited_idx = last_cited_idx - 1 if last_cited_idx > 0 else None
+
+    st.session_state.roles.append(role)
+    st.session_state.contents.append(content)
+    st.session_state.cites.append(citations)
+    st.session_state.flags.append(flags)
+
+    if citations:
+        st.session_state.last_cited_idx = len(st.session_state.roles) - 1
+
 # Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+if "roles" not in st.session_state:
+    reset_chat_history()
 if "session_id" not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
+if "debug_mode" not in st.session_state:
+    st.session_state.debug_mode = False
+
+# Debug mode for this run; the checkbox is keyed on debug_mode, so a toggle is
+# already reflected here when the resulting rerun starts
+DEBUG = st.session_state.debug_mode
 
 def validate_response_integrity(text, original_length):
     """Validate that the response hasn't been corrupted or truncated"""
@@ -40,58 +87,67 @@ def validate_response_integrity(text, original_length):
 
     return issues
 
-def cleanup_response_text(text):
-    """Clean up response text by removing unwanted characters and phrases"""
-    import re
+# Phrases that shouldn't be in the final output, compiled once into a single alternation
+_UNWANTED_RE = re.compile(
+    r"(?i)(?:"
+    # Atomic "(?>(?:the )?(?:table in (?:the )?)?)" written as lookahead + backreference
+    # so it also works before Python 3.11; the engine can't backtrack into the optional words
+    r"this is (?:also )?(?:outlined|mentioned|stated|found|shown) in (?=((?:the )?(?:table in (?:the )?)?))\1search results"
+    r"|this (?:information is found|can be found) in the search results"
+    r"|as (?:mentioned|shown|outlined|stated) in the search results"
+    r"|according to the search results"
+    r"|based on the search results"
+    r"|the search results indicate"
+    r")\.?"
+)
+_MULTI_SPACE_RE = re.compile(r' +')
+_MULTI_NL_RE = re.compile(r'\n{3,}')
+# Whitespace (other than the newline itself) around each line break
+_TRIM_LINES_RE = re.compile(r'[^\S\n]*\n[^\S\n]*')
+
+# Characters a complete answer may start with besides an uppercase letter
+_ANSWER_START_CHARS = '(["\'0123456789'
 
+def response_flags(text):
+    """
+    Compute the history warnings for an assistant response once, when it is recorded:
+    (suspiciously short, appears to start mid-sentence)
+    """
+    return (
+        len(text) < 20,
+        bool(text) and not text[0].isupper() and text[0] not in _ANSWER_START_CHARS
+    )
+
+def cleanup_response_text(text, debug=False):
+    """Clean up response text by removing unwanted characters and phrases"""
     # Store original for validation
     original_text = text
     original_length = len(text)
 
-    # Remove literal \n strings (not actual newlines)
-    text = text.replace('\\n', '\n')
-
-    # Remove other escape sequences that might appear as literal text
-    text = text.replace('\\t', ' ')
-    text = text.replace('\\r', '')
+    # Escape sequences and unwanted phrases are rare, so rule them out with a
+    # cheap substring check before doing any rewriting
+    if '\\' in text:
+        # Remove literal \n strings (not actual newlines) and other escape sequences
+        # that might appear as literal text; chained str.replace beats a regex callback here
+        text = text.replace('\\n', '\n').replace('\\t', ' ').replace('\\r', '')
 
     # Remove phrases that shouldn't be in the final output
-    unwanted_phrases = [
-        r'This is outlined in the search results\.?',
-        r'This is also outlined in the search results\.?',
-        r'This is mentioned in the search results\.?',
-        r'This is also mentioned in the search results\.?',
-        r'As mentioned in the search results\.?',
-        r'According to the search results\.?',
-        r'The search results indicate\.?',
-        r'Based on the search results\.?',
-        r'As shown in the search results\.?',
-        r'As outlined in the search results\.?',
-        r'As stated in the search results\.?',
-        r'This is outlined in the table in the search results\.?',
-        r'This is also outlined in the table in the search results\.?',
-        r'This information is found in the search results\.?',
-        r'This can be found in the search results\.?',
-        r'[Tt]his is (?:also )?(?:outlined|mentioned|stated|found|shown) in (?:the )?(?:table in )?(?:the )?search results\.?',
-    ]
-
-    for phrase in unwanted_phrases:
-        text = re.sub(phrase, '', text, flags=re.IGNORECASE)
+    if 'search results' in text.lower():
+        text = _UNWANTED_RE.sub('', text)
 
     # Clean up multiple spaces
-    text = re.sub(r' +', ' ', text)
+    text = _MULTI_SPACE_RE.sub(' ', text)
 
     # Clean up multiple newlines (more than 2 in a row)
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = _MULTI_NL_RE.sub('\n\n', text)
 
     # Remove trailing/leading whitespace from each line
-    lines = [line.strip() for line in text.split('\n')]
-    text = '\n'.join(lines)
+    text = _TRIM_LINES_RE.sub('\n', text)
 
     cleaned_text = text.strip()
 
     # Validate integrity
-    if st.session_state.get("debug_mode", False):
+    if debug:
         issues = validate_response_integrity(cleaned_text, original_length)
         if issues:
             print(f"⚠️ Response validation issues: {issues}")
@@ -101,26 +157,63 @@ def cleanup_response_text(text):
 
     return cleaned_text
 
+def flatten_citations(citations, debug=False):
+    """
+    Flatten Bedrock citations into (source_name, uri, text, count) tuples once, at response
+    time, so reruns don't have to walk the nested reference structure again. References
+    repeating the same passage of the same document are merged and counted.
+    """
+    seen = {}
+    for citation in citations:
+        for reference in citation.get('retrievedReferences', []):
+            content = reference.get('content', {})
+
+            # Try to extract text from different possible fields
+            text = None
+            if 'text' in content and content['text']:
+                text = content['text'].strip()
+            elif 'content' in content and content['content']:
+                text = content['content'].strip()
+
+            # Skip this citation if there's no actual text content
+            if not text:
+                # Debug mode: Log when text is not found
+                if debug:
+                    print(f"Citation reference has no text. Content structure: {content.keys()}")
+                continue
+
+            # Get source location info
+            uri = reference.get('location', {}).get('s3Location', {}).get('uri', 'Unknown source')
+
+            key = (uri, text)
+            if key in seen:
+                seen[key][3] += 1
+            else:
+                source_name = uri.rpartition('/')[2] or uri
+                seen[key] = [source_name, uri, text, 1]
+
+    return [tuple(entry) for entry in seen.values()]
+
+_CITE_MARKER_RE = re.compile(r'\[\d+\]')
+
 def insert_citation_markers(text, citations):
     """Insert numbered citation markers [1], [2], etc. into the text"""
     # For now, append citation markers at the end of sentences
     # In a more sophisticated version, we'd use citation span data from Bedrock
-    if not citations or len(citations) == 0:
+    if not citations:
         return text
 
     # Simple approach: add all citation numbers at the end
-    citation_count = sum(len(c.get('retrievedReferences', [])) for c in citations)
-    if citation_count > 0:
-        markers = ' '.join([f'[{i+1}]' for i in range(citation_count)])
-        # Add markers at the end if not already present
-        if not any(f'[{i+1}]' in text for i in range(citation_count)):
-            text = f"{text} {markers}"
+    # Add markers at the end if not already present
+    if not _CITE_MARKER_RE.search(text):
+        markers = ' '.join(f'[{i}]' for i in range(1, len(citations) + 1))
+        text = f"{text} {markers}"
 
     return text
 
 def display_citation_sidebar(citations):
-    """Display citations in a right sidebar panel"""
-    if not citations or len(citations) == 0:
+    """Display flattened citations in a right sidebar panel"""
+    if not citations:
         st.markdown("*No citations available*")
         return
 
@@ -128,198 +221,115 @@ def display_citation_sidebar(citations):
     st.caption("Referenced documents")
     st.markdown("---")
 
-    citation_num = 1
-    for citation in citations:
-        retrieved_references = citation.get('retrievedReferences', [])
-
-        for reference in retrieved_references:
-            location = reference.get('location', {})
-            content = reference.get('content', {})
-
-            # Try to extract text from different possible fields
-            text = None
-            if 'text' in content and content['text']:
-                text = content['text'].strip()
-            elif 'content' in content and content['content']:
-                text = content['content'].strip()
-
-            # Debug mode: Log when text is not found
-            if st.session_state.get("debug_mode", False) and not text:
-                print(f"Citation {citation_num} has no text. Content structure: {content.keys()}")
+    # All passages come from one document: show the source once with a single expander
+    if len({uri for _, uri, _, _ in citations}) == 1:
+        source_name, uri = citations[0][0], citations[0][1]
+        st.markdown(f"**{source_name}**")
+        st.caption(f"Source: {uri}")
+        with st.expander("📖 View source text", expanded=False):
+            for citation_num, (_, _, text, count) in enumerate(citations, start=1):
+                badge = f" ×{count}" if count > 1 else ""
+                st.markdown(f"**[{citation_num}]**{badge}")
+                st.markdown(f"<div style='font-size: 0.9rem; line-height: 1.4;'>{text}</div>", unsafe_allow_html=True)
+        return
 
-            # Skip this citation if there's no actual text content
-            if not text or text == '':
-                continue
+    for citation_num, (source_name, uri, text, count) in enumerate(citations, start=1):
+        badge = f" ×{count}" if count > 1 else ""
 
-            # Get source location info
-            s3_location = location.get('s3Location', {})
-            uri = s3_location.get('uri', 'Unknown source')
-            source_name = uri.split('/')[-1] if '/' in uri else uri
+        # Display numbered citation with consistent, smaller sizing
+        st.markdown(f"**[{citation_num}]** {source_name}{badge}")
+        with st.expander("📖 View source text", expanded=False):
+            st.caption(f"Source: {uri}")
+            st.markdown(f"<div style='font-size: 0.9rem; line-height: 1.4;'>{text}</div>", unsafe_allow_html=True)
+        st.divider()
 
-            # Display numbered citation with consistent, smaller sizing
-            st.markdown(f"**[{citation_num}]** {source_name}")
-            with st.expander("📖 View source text", expanded=False):
-                st.caption(f"Source: {uri}")
-                st.markdown(f"<div style='font-size: 0.9rem; line-height: 1.4;'>{text}</div>",
-                           unsafe_allow_html=True)
-            st.divider()
+def finalize_completion(completion, citations, debug=False):
+    """
+    Clean up the fully streamed completion and validate the result
+    """
+    # Debug logging
+    if debug:
+        print(f"\n=== Response Processing Debug ===")
+        print(f"Raw response length: {len(completion)} characters")
+        print(f"First 200 chars of raw response: {completion[:200]}")
+
+    # Store raw completion before cleanup for validation
+    raw_completion = completion
+
+    # Clean up the response text
+    completion = cleanup_response_text(completion, debug=debug)
+
+    # Validation: Check if cleanup removed too much
+    length_diff = len(raw_completion) - len(completion)
+    if debug:
+        print(f"Cleanup removed {length_diff} characters")
+        if length_diff > len(raw_completion) * 0.3:  # More than 30% removed
+            print(f"⚠️ WARNING: Cleanup removed more than 30% of content!")
+
+    # Debug: Log citation count
+    if debug:
+        if citations:
+            print(f"Found {len(citations)} citations")
+        else:
+            print("No citations found in response")
+        print(f"=== End Debug ===\n")
 
-            citation_num += 1
+    # Final validation
+    if not completion or len(completion) < 5:
+        print(f"❌ ERROR: Final response is empty or too short!")
+        print(f"Raw response was: {raw_completion[:500]}")
+        # Return raw response if cleanup failed
+        completion = raw_completion.strip() if raw_completion else "Error: Empty response received"
 
-    # If no valid citations were found after filtering
-    if citation_num == 1:
-        st.markdown("*No citation text available*")
+    return completion
 
-# AWS Configuration - Get from environment variables or Streamlit secrets
-try:
-    AWS_REGION = st.secrets.get("AWS_REGION", os.getenv("AWS_REGION", "us-east-1"))
-    AGENT_ID = st.secrets.get("AGENT_ID", os.getenv("AGENT_ID"))
-    AGENT_ALIAS_ID = st.secrets.get("AGENT_ALIAS_ID", os.getenv("AGENT_ALIAS_ID"))
-    AWS_ACCESS_KEY_ID = st.secrets.get("AWS_ACCESS_KEY_ID", os.getenv("AWS_ACCESS_KEY_ID"))
-    AWS_SECRET_ACCESS_KEY = st.secrets.get("AWS_SECRET_ACCESS_KEY", os.getenv("AWS_SECRET_ACCESS_KEY"))
-except:
-    AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
-    AGENT_ID = os.getenv("AGENT_ID")
-    AGENT_ALIAS_ID = os.getenv("AGENT_ALIAS_ID")
-    AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-    AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-
-# Initialize Bedrock Agent Runtime client
-@st.cache_resource
-def get_bedrock_client():
-    if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
-        return boto3.client(
-            service_name='bedrock-agent-runtime',
-            region_name=AWS_REGION,
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
-    else:
-        # Use default credentials (IAM role, profile, etc.)
-        return boto3.client(
-            service_name='bedrock-agent-runtime',
-            region_name=AWS_REGION
-        )
+# Streaming render settings: coalesce chunks before repainting the placeholder
+STREAM_FLUSH_INTERVAL = 0.08  # seconds
+STREAM_FLUSH_CHARS = 64
 
-def invoke_bedrock_agent(prompt, session_id=None):
+def stream_to_placeholder(placeholder, chunks):
     """
-    Invoke the Bedrock Agent with the given prompt and return response with citations
+    Render streamed text into a placeholder as plain text, flushing at most every
+    STREAM_FLUSH_INTERVAL seconds or STREAM_FLUSH_CHARS characters. Returns the full text.
+    The caller is expected to do the final markdown render once the stream ends.
     """
-    try:
-        client = get_bedrock_client()
-
-        # Generate or use existing session ID
-        if session_id:
-            current_session_id = session_id
-        elif st.session_state.session_id:
-            current_session_id = st.session_state.session_id
-        else:
-            # Generate a new UUID if somehow none exists
-            current_session_id = str(uuid.uuid4())
-            st.session_state.session_id = current_session_id
-
-        # Prepare the request parameters
-        request_params = {
-            'agentId': AGENT_ID,
-            'agentAliasId': AGENT_ALIAS_ID,
-            'sessionId': current_session_id,
-            'inputText': prompt
-        }
-
-        # Invoke the agent
-        response = client.invoke_agent(**request_params)
-
-        # Extract the session ID for continuity
-        if 'sessionId' in response:
-            st.session_state.session_id = response['sessionId']
-
-        # Process the streaming response and collect citations
-        completion = ""
-        citations = []
-        chunk_count = 0
-        raw_chunks = []  # For debugging
-
-        for event in response.get('completion', []):
-            # Handle different event types
-            if 'chunk' in event:
-                chunk = event['chunk']
-                chunk_count += 1
-
-                if 'bytes' in chunk:
-                    decoded_chunk = chunk['bytes'].decode('utf-8')
-                    completion += decoded_chunk
-
-                    # Store first few chunks for debugging
-                    if st.session_state.get("debug_mode", False) and chunk_count <= 3:
-                        raw_chunks.append(decoded_chunk)
-
-                # Check for attribution in chunk
-                if 'attribution' in chunk:
-                    attribution = chunk['attribution']
-                    if 'citations' in attribution:
-                        citations.extend(attribution['citations'])
-
-            # Also check for citations at event level
-            if 'citations' in event:
-                citations.extend(event['citations'])
-
-        # Debug logging
-        if st.session_state.get("debug_mode", False):
-            print(f"\n=== Response Processing Debug ===")
-            print(f"Total chunks received: {chunk_count}")
-            print(f"Raw response length: {len(completion)} characters")
-            print(f"First 200 chars of raw response: {completion[:200]}")
-            if raw_chunks:
-                print(f"First chunk content: {raw_chunks[0][:100]}")
-
-        # Store raw completion before cleanup for validation
-        raw_completion = completion
-
-        # Clean up the response text
-        completion = cleanup_response_text(completion)
-
-        # Validation: Check if cleanup removed too much
-        length_diff = len(raw_completion) - len(completion)
-        if st.session_state.get("debug_mode", False):
-            print(f"Cleanup removed {length_diff} characters")
-            if length_diff > len(raw_completion) * 0.3:  # More than 30% removed
-                print(f"⚠️ WARNING: Cleanup removed more than 30% of content!")
-
-        # Debug: Log citation count
-        if st.session_state.get("debug_mode", False):
-            if citations:
-                print(f"Found {len(citations)} citations")
-            else:
-                print("No citations found in response")
-            print(f"=== End Debug ===\n")
-
-        # Final validation
-        if not completion or len(completion) < 5:
-            print(f"❌ ERROR: Final response is empty or too short!")
-            print(f"Raw response was: {raw_completion[:500]}")
-            # Return raw response if cleanup failed
-            completion = raw_completion.strip() if raw_completion else "Error: Empty response received"
-
-        return {"text": completion, "citations": citations}
-
-    except ClientError as e:
-        error_message = f"AWS Error: {str(e)}"
-        st.error(error_message)
-        return {"text": f"Error: {error_message}", "citations": []}
-    except Exception as e:
-        error_message = f"Error invoking agent: {str(e)}"
-        st.error(error_message)
-        return {"text": f"Error: {error_message}", "citations": []}
+    # Waiting indicator until the agent starts responding
+    placeholder.caption("Thinking...")
+
+    text = ""
+    pending = []  # pieces received since the last flush
+    pending_chars = 0
+    last_flush = None
+
+    for piece in chunks:
+        if not piece:
+            continue
+        pending.append(piece)
+        pending_chars += len(piece)
+
+        # The first text replaces the waiting indicator right away
+        now = time.monotonic()
+        if last_flush is None or now - last_flush > STREAM_FLUSH_INTERVAL or pending_chars > STREAM_FLUSH_CHARS:
+            # Extend the running text with only the new pieces instead of re-joining everything
+            text += "".join(pending)
+            pending.clear()
+            pending_chars = 0
+            # Plain text during the stream avoids re-parsing the markdown each flush
+            placeholder.text(text)
+            last_flush = now
+
+    if pending:
+        text += "".join(pending)
+
+    return text
 
 # UI
-# Custom CSS to center the title and caption, and style citations
-st.markdown("""
+# Static stylesheet and caption, built once as a single string. Streamlit drops any
+# element not re-emitted during a rerun, so this still goes out every run, as one element.
+CUSTOM_CSS = """
     <style>
-    .main-title {
+    #app-title {
         text-align: center;
-        font-size: 3rem;
-        font-weight: 600;
-        margin-bottom: 0.5rem;
     }
     .main-caption {
         text-align: center;
@@ -327,24 +337,15 @@ st.markdown("""
         color: #666;
         margin-bottom: 1rem;
     }
-    /* Citation sidebar styling */
-    .citation-text {
-        font-size: 0.9rem;
-        line-height: 1.5;
-        color: #333;
-    }
-    .citation-source {
-        font-size: 0.85rem;
-        color: #666;
-    }
     </style>
-    <div class="main-title">📋 Mississippi ITS Procurement Assistant</div>
     <div class="main-caption">Your AI-powered guide for procurement questions and guidance</div>
-""", unsafe_allow_html=True)
+"""
+st.title("📋 Mississippi ITS Procurement Assistant", anchor="app-title")
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 st.divider()
 
 # Configuration check
-if not AGENT_ID or not AGENT_ALIAS_ID:
+if not config.agent_id or not config.agent_alias_id:
     st.warning("⚠️ Please configure your Agent ID and Agent Alias ID in the environment variables or Streamlit secrets.")
     st.info("""
     **Configuration needed:**
@@ -363,24 +364,21 @@ with st.sidebar:
     st.divider()
 
     if st.button("🔄 New Conversation", use_container_width=True):
-        st.session_state.messages = []
+        reset_chat_history()
         st.session_state.session_id = str(uuid.uuid4())
         st.rerun()
 
     st.divider()
 
     # Debug mode toggle (can be enabled for troubleshooting)
-    if "debug_mode" not in st.session_state:
-        st.session_state.debug_mode = False
-
     # Show debug toggle in an expander to keep UI clean
     with st.expander("⚙️ Advanced Settings"):
-        st.session_state.debug_mode = st.checkbox(
+        st.checkbox(
             "Enable Debug Mode",
-            value=st.session_state.debug_mode,
+            key="debug_mode",
             help="Shows detailed logging in terminal for troubleshooting response issues"
         )
-        if st.session_state.debug_mode:
+        if DEBUG:
             st.caption("⚠️ Debug output will appear in your terminal/console")
 
     st.divider()
@@ -397,106 +395,119 @@ SUGGESTED_QUESTIONS = [
 ]
 
 # Display suggested questions if no messages yet
-if len(st.session_state.messages) == 0:
-    st.markdown("### 💡 Suggested Questions")
-    st.markdown("Get started by asking one of these common questions:")
-
-    # Create columns for better layout
-    cols = st.columns(2)
-    for idx, question in enumerate(SUGGESTED_QUESTIONS):
-        col = cols[idx % 2]
-        with col:
-            if st.button(question, key=f"suggested_{idx}", use_container_width=True):
-                # Store the selected question to process it
-                st.session_state.selected_question = question
-                st.rerun()
-
-    st.divider()
+prompt = None
+if not st.session_state.roles:
+    suggestions = st.empty()
+    with suggestions.container():
+        st.markdown("### 💡 Suggested Questions")
+        st.markdown("Get started by asking one of these common questions:")
+
+        # A single pills widget instead of one button per question;
+        # the selection is handled in this run by the prompt handling below
+        prompt = st.pills(
+            "Suggested questions",
+            SUGGESTED_QUESTIONS,
+            selection_mode="single",
+            key="suggested_question",
+            label_visibility="collapsed"
+        )
 
-# Handle selected question from suggested questions
-if hasattr(st.session_state, 'selected_question') and st.session_state.selected_question:
-    prompt = st.session_state.selected_question
-    st.session_state.selected_question = None  # Clear the selected question
+        st.divider()
 
-    # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    # Clear the suggestions while the selected question is answered
+    if prompt:
+        suggestions.empty()
 
-    # Get agent response
-    with st.spinner("Thinking..."):
-        response = invoke_bedrock_agent(prompt)
-
-    # Add assistant response to chat history with citations
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": response["text"],
-        "citations": response.get("citations", [])
-    })
-    st.rerun()
+# Only the most recent messages get their own chat bubbles; older ones are batched
+# into a single markdown element so long conversations don't add widgets per message
+HISTORY_LIVE_MESSAGES = 10
+ROLE_LABELS = {"user": "🧑 You", "assistant": "🤖 Assistant"}
 
 # Create main layout: content area on left, citation sidebar on right
 col_main, col_sidebar = st.columns([7, 3])
 
 with col_main:
-    # Display chat messages
-    for msg_idx, message in enumerate(st.session_state.messages):
-        with st.chat_message(message["role"]):
-            content = message["content"]
-
-            # Check for potential issues with assistant responses
-            if message["role"] == "assistant":
-                # Validate response quality
-                if len(content) < 20:
+    earlier_count = max(len(st.session_state.roles) - HISTORY_LIVE_MESSAGES, 0)
+    if earlier_count:
+        with st.expander(f"Earlier messages ({earlier_count})"):
+            st.markdown("\n\n---\n\n".join(
+                f"**{ROLE_LABELS[role]}**\n\n{content}"
+                for role, content in islice(zip(st.session_state.roles, st.session_state.contents),
+                                            earlier_count)
+            ))
+
+    # Display recent chat messages
+    for role, content, flags in islice(zip(st.session_state.roles,
+                                           st.session_state.contents,
+                                           st.session_state.flags),
+                                       earlier_count, None):
+        with st.chat_message(role):
+            # Potential issues with assistant responses, checked when they were recorded
+            if flags:
+                is_short, starts_mid_sentence = flags
+                if is_short:
                     st.warning("⚠️ This response seems unusually short. There may have been an issue.")
-
-                # Check if response starts mid-sentence
-                if content and not content[0].isupper() and content[0] not in ['(', '[', '"', "'", '1', '2', '3', '4', '5', '6', '7', '8', '9', '0']:
+                if starts_mid_sentence:
                     st.info("ℹ️ Note: This response may have been truncated at the beginning.")
 
-                # Add citation markers if this is an assistant message with citations
-                if message.get("citations"):
-                    content = insert_citation_markers(content, message["citations"])
-
             st.markdown(content)
 
 with col_sidebar:
-    # Display citations for the most recent assistant message with citations
     st.markdown("---")
+    citation_panel = st.empty()
+
+def render_citation_panel(citations):
+    """Fill the citation sidebar panel, replacing whatever it showed before"""
+    with citation_panel.container():
+        if citations:
+            display_citation_sidebar(citations)
+
+            # Debug mode: Show citation data
+            if DEBUG:
+                with st.expander("🔧 Debug: Citation Data"):
+                    st.json(citations)
+        else:
+            st.markdown("### 📚 Sources")
+            st.markdown("*Citations will appear here*")
 
-    # Find the last assistant message with citations
-    last_cited_message = None
-    for message in reversed(st.session_state.messages):
-        if (message["role"] == "assistant" and
-            "citations" in message and
-            len(message.get("citations", [])) > 0):
-            last_cited_message = message
-            break
-
-    if last_cited_message:
-        display_citation_sidebar(last_cited_message["citations"])
-
-        # Debug mode: Show raw citation data
-        if st.session_state.get("debug_mode", False):
-            with st.expander("🔧 Debug: Raw Citation Data"):
-                st.json(last_cited_message["citations"])
-    else:
-        st.markdown("### 📚 Sources")
-        st.markdown("*Citations will appear here*")
-
-# Chat input
-if prompt := st.chat_input("Ask about procurement processes, guidelines, or requirements..."):
+# Display citations for the most recent assistant message with citations
+last_cited_idx = st.session_state.last_cited_idx
+render_citation_panel(st.session_state.cites[last_cited_idx] if last_cited_idx is not None else None)
+
+def handle_prompt(prompt):
+    """Add the prompt to the chat history, stream the agent response and record it"""
     # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    append_message("user", prompt)
+
+    with col_main:
+        with st.chat_message("user"):
+            st.markdown(prompt)
 
-    # Get agent response
-    with st.spinner("Thinking..."):
-        response = invoke_bedrock_agent(prompt)
+        # Stream the agent response as it arrives
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+            raw_citations = []
+            completion = stream_to_placeholder(placeholder, stream_agent(prompt, raw_citations, debug=DEBUG))
+
+            # Single markdown render of the cleaned response once the stream ends
+            completion = finalize_completion(completion, raw_citations, debug=DEBUG)
+            citations = flatten_citations(raw_citations, debug=DEBUG)
+            flags = response_flags(completion)
+
+            # Citation markers are added once here and stored with the message
+            completion = insert_citation_markers(completion, citations)
+            placeholder.markdown(completion)
 
     # Add assistant response to chat history with citations
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": response["text"],
-        "citations": response.get("citations", [])
-    })
-
-    # Rerun to update the display with the new message
-    st.rerun()
+    append_message("assistant", completion, citations, flags)
+
+    # Update the sidebar in place rather than rerunning the whole script
+    if citations:
+        render_citation_panel(citations)
+
+# Chat input; a suggested question clicked above is handled the same way
+if user_input := st.chat_input("Ask about procurement processes, guidelines, or requirements..."):
+    prompt = user_input
+
+if prompt:
+    handle_prompt(prompt)
@@ -0,0 +1,205 @@
+import streamlit as st
+import codecs
+import os
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
+
+try:
+    from streamlit.errors import StreamlitSecretNotFoundError
+except ImportError:
+    # Older Streamlit versions raise FileNotFoundError when no secrets file exists
+    StreamlitSecretNotFoundError = FileNotFoundError
+
+# Bedrock Agent glue shared by the Streamlit UI. Unlike app.py, which Streamlit
+# re-executes on every rerun, this module is imported once per process. boto3 and
+# botocore are imported lazily so an unconfigured app never pays for loading them.
+
+# AWS Configuration - Get from environment variables or Streamlit secrets
+AgentConfig = namedtuple(
+    "AgentConfig",
+    ["aws_region", "agent_id", "agent_alias_id", "aws_access_key_id", "aws_secret_access_key"]
+)
+
+def _secrets_dict():
+    """Read Streamlit secrets; an empty dict when no secrets file exists"""
+    try:
+        return dict(st.secrets)
+    except (FileNotFoundError, StreamlitSecretNotFoundError):
+        return {}
+
+@st.cache_data(show_spinner=False)
+def load_config():
+    """Resolve configuration once instead of probing secrets on every rerun"""
+    secrets = _secrets_dict()
+    return AgentConfig(
+        aws_region=secrets.get("AWS_REGION") or os.getenv("AWS_REGION", "us-east-1"),
+        agent_id=secrets.get("AGENT_ID") or os.getenv("AGENT_ID"),
+        agent_alias_id=secrets.get("AGENT_ALIAS_ID") or os.getenv("AGENT_ALIAS_ID"),
+        aws_access_key_id=secrets.get("AWS_ACCESS_KEY_ID") or os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=secrets.get("AWS_SECRET_ACCESS_KEY") or os.getenv("AWS_SECRET_ACCESS_KEY")
+    )
+
+# Connection pooling, keepalive and retry settings shared by all sessions
+BEDROCK_CLIENT_SETTINGS = dict(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+    read_timeout=120,
+    connect_timeout=10
+)
+
+# Initialize Bedrock Agent Runtime client
+@lru_cache(maxsize=None)
+def get_client(boto3_session=None):
+    """
+    Create the Bedrock Agent Runtime client once per process (or once per injected session).
+    Pass boto3_session to reuse an existing session, e.g. a named profile, instead of one
+    built from the resolved configuration.
+    """
+    import boto3
+    from botocore.config import Config
+
+    if boto3_session is None:
+        config = load_config()
+
+        # Resolve credentials and region once through a single session
+        if config.aws_access_key_id and config.aws_secret_access_key:
+            boto3_session = boto3.Session(
+                region_name=config.aws_region,
+                aws_access_key_id=config.aws_access_key_id,
+                aws_secret_access_key=config.aws_secret_access_key
+            )
+        else:
+            # Use default credentials (IAM role, profile, etc.)
+            boto3_session = boto3.Session(region_name=config.aws_region)
+
+    return boto3_session.client(
+        service_name='bedrock-agent-runtime',
+        config=Config(**BEDROCK_CLIENT_SETTINGS)
+    )
+
+# Bounded pool for the blocking invoke_agent calls of all browser sessions
+AGENT_INVOKE_WORKERS = 32
+AGENT_INVOKE_TIMEOUT = 60  # seconds to wait for the agent to start responding
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=AGENT_INVOKE_WORKERS, thread_name_prefix="bedrock-invoke")
+
+def _close_orphaned_response(future):
+    """Close the completion stream of a call we stopped waiting for, releasing its pooled connection"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    completion = future.result().get('completion')
+    if completion is not None:
+        completion.close()
+
+def stream_agent(prompt, citations_out, session_id=None, debug=False):
+    """
+    Invoke the Bedrock Agent with the given prompt and yield response text as it arrives.
+    Citations are collected into citations_out as the stream is consumed.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        config = load_config()
+
+        # Generate or use existing session ID
+        if session_id:
+            current_session_id = session_id
+        elif st.session_state.session_id:
+            current_session_id = st.session_state.session_id
+        else:
+            # Generate a new UUID if somehow none exists
+            current_session_id = str(uuid.uuid4())
+            st.session_state.session_id = current_session_id
+
+        # Prepare the request parameters
+        request_params = {
+            'agentId': config.agent_id,
+            'agentAliasId': config.agent_alias_id,
+            'sessionId': current_session_id,
+            'inputText': prompt,
+            # No trace events ahead of the first chunk, and stream the final
+            # response as it is generated instead of as one block at the end
+            'enableTrace': False,
+            'streamingConfigurations': {
+                'streamFinalResponse': True,
+                'applyGuardrailInterval': 50
+            }
+        }
+
+        # Invoke the agent on the shared pool so concurrent sessions stay bounded
+        future = _EXECUTOR.submit(get_client().invoke_agent, **request_params)
+        response = future.result(timeout=AGENT_INVOKE_TIMEOUT)
+
+        # Extract the session ID for continuity
+        if 'sessionId' in response:
+            st.session_state.session_id = response['sessionId']
+
+        # Yield the streaming response and collect citations. The incremental decoder
+        # carries multi-byte characters split across chunk boundaries over to the next chunk.
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        chunk_count = 0
+        raw_chunks = []  # For debugging
+
+        for event in response.get('completion', []):
+            # Handle different event types
+            if 'chunk' in event:
+                chunk = event['chunk']
+                chunk_count += 1
+
+                if 'bytes' in chunk:
+                    decoded_chunk = decoder.decode(chunk['bytes'])
+
+                    # Store first few chunks for debugging
+                    if debug and chunk_count <= 3:
+                        raw_chunks.append(decoded_chunk)
+
+                    yield decoded_chunk
+
+                # Check for attribution in chunk
+                if 'attribution' in chunk:
+                    attribution = chunk['attribution']
+                    if 'citations' in attribution:
+                        citations_out.extend(attribution['citations'])
+
+            # Also check for citations at event level
+            if 'citations' in event:
+                citations_out.extend(event['citations'])
+
+        # Flush any bytes still held by the decoder
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+        # Debug logging
+        if debug:
+            print(f"\n=== Stream Debug ===")
+            print(f"Total chunks received: {chunk_count}")
+            if raw_chunks:
+                print(f"First chunk content: {raw_chunks[0][:100]}")
+
+    except ClientError as e:
+        error_message = f"AWS Error: {str(e)}"
+        st.error(error_message)
+        yield f"Error: {error_message}"
+    except FutureTimeoutError:
+        # Drop the call if it is still queued; otherwise close its stream once it returns
+        if not future.cancel():
+            future.add_done_callback(_close_orphaned_response)
+        error_message = f"The agent did not respond within {AGENT_INVOKE_TIMEOUT} seconds"
+        st.error(error_message)
+        yield f"Error: {error_message}"
+    except Exception as e:
+        error_message = f"Error invoking agent: {str(e)}"
+        st.error(error_message)
+        yield f"Error: {error_message}"
+
+def invoke_agent(prompt, session_id=None, debug=False):
+    """
+    Invoke the Bedrock Agent and return the complete raw response text with its citations
+    """
+    citations = []
+    completion = "".join(stream_agent(prompt, citations, session_id, debug=debug))
+    return {"text": completion, "citations": citations}